@@ -3,10 +3,12 @@
 Script to download attachments for all tickets from Freshdesk
 """
 import os
-import json
+import shutil
 import argparse
 import logging
-from freshdesk_client import FreshdeskClient
+from concurrent.futures import ThreadPoolExecutor
+import json_utils
+from freshdesk_client import FreshdeskClient, safe_filename
 
 # Set up logging
 logging.basicConfig(
@@ -15,6 +17,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Most conversations the view-ticket endpoint embeds with include=conversations
+EMBEDDED_CONVERSATIONS_LIMIT = 10
+
 def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description='Download attachments for Freshdesk tickets')
@@ -22,6 +27,7 @@ def parse_arguments():
     parser.add_argument('--api-key', required=True, help='Freshdesk API key')
     parser.add_argument('--tickets-file', help='JSON file containing tickets (if not provided, will fetch tickets)')
     parser.add_argument('--output-dir', default='./attachments', help='Directory to save attachments')
+    parser.add_argument('--workers', type=int, default=32, help='Number of concurrent downloads')
     return parser.parse_args()
 
 def load_tickets_from_file(file_path):
@@ -34,86 +40,298 @@ def load_tickets_from_file(file_path):
     Returns:
         list: List of ticket objects
     """
-    with open(file_path, 'r') as f:
-        tickets = json.load(f)
+    with open(file_path, 'rb') as f:
+        tickets = json_utils.loads(f.read())
     
     logger.info(f"Loaded {len(tickets)} tickets from {file_path}")
     return tickets
 
-def download_attachments_for_ticket(client, ticket_id, output_dir):
+def prepare_ticket(client, ticket, output_dir):
     """
-    Download all attachments for a specific ticket
+    Get ticket details and save its metadata to the ticket directory
+    
+    Details are taken from the ticket itself when it already lists its
+    attachments and conversations, then from the metadata saved by a previous run if the ticket
+    has not been updated since, and only otherwise fetched from Freshdesk. Freshdesk embeds
+    at most 10 conversations in a ticket, so when that many are present the full list is
+    paged from the conversations endpoint, and attachments on later replies are included.
     
     Args:
         client (FreshdeskClient): Freshdesk client
-        ticket_id (int): Ticket ID
+        ticket (dict): Ticket object
         output_dir (str): Directory to save attachments
         
     Returns:
-        list: List of paths to downloaded attachments
+        tuple: Ticket directory and list of attachment objects
     """
-    # Get ticket details to access attachments
-    ticket = client.get_ticket(ticket_id)
+    ticket_id = ticket['id']
     
-    # Create ticket-specific directory
+    # Create ticket-specific directory (output_dir normally exists, so a single mkdir suffices)
     ticket_dir = os.path.join(output_dir, f"ticket_{ticket_id}")
-    os.makedirs(ticket_dir, exist_ok=True)
-    
-    # Save ticket metadata
+    try:
+        os.mkdir(ticket_dir)
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        os.makedirs(ticket_dir, exist_ok=True)
     ticket_metadata_path = os.path.join(ticket_dir, "ticket_metadata.json")
-    with open(ticket_metadata_path, 'w') as f:
-        json.dump(ticket, f, indent=2)
     
-    # Get attachments
-    attachments = ticket.get('attachments', [])
+    details = None
+    cached = None
+    if 'attachments' in ticket and 'conversations' in ticket:
+        details = ticket
+    elif os.path.exists(ticket_metadata_path):
+        with open(ticket_metadata_path, 'rb') as f:
+            cached = json_utils.loads(f.read())
+        if cached.get('updated_at') == ticket.get('updated_at') and 'conversations' in cached:
+            logger.debug(f"Using cached details for ticket {ticket_id}")
+            details = cached
+    
+    if details is None:
+        # Get ticket details, with conversations, to access all attachments in one request
+        details = client.get_ticket(ticket_id, include='conversations')
+        if len(details.get('conversations', [])) >= EMBEDDED_CONVERSATIONS_LIMIT:
+            # Only the first conversations are embedded, so page through all of them
+            details['conversations'] = client.get_ticket_conversations(ticket_id)
+    
+    if details is not cached:
+        # Save ticket metadata, which the upload step sends with the attachments
+        with open(ticket_metadata_path, 'wb') as f:
+            f.write(json_utils.dumps(details))
+    
+    # Get attachments of the ticket and of its conversations
+    attachments = list(details.get('attachments', []))
+    for conversation in details.get('conversations', []):
+        attachments.extend(conversation.get('attachments', []))
     if not attachments:
         logger.info(f"No attachments found for ticket {ticket_id}")
-        return []
+    else:
+        logger.info(f"Found {len(attachments)} attachments for ticket {ticket_id}")
+    
+    return ticket_dir, attachments
+
+def attachment_file_name(attachment):
+    """
+    Get the local file name of an attachment
     
-    logger.info(f"Found {len(attachments)} attachments for ticket {ticket_id}")
+    Args:
+        attachment (dict): Attachment object
+        
+    Returns:
+        str: Attachment name without any directory parts, or attachment_<id> if it has none
+    """
+    return safe_filename(attachment.get('name')) or f"attachment_{attachment['id']}"
+
+def assign_file_names(attachments):
+    """
+    Give each attachment of a ticket a distinct local file name
+    
+    Attachments whose name is already taken in the ticket (such as inline
+    image.png files on several replies), or that clash with the ticket's
+    metadata file, are prefixed with their ID. Names are compared
+    case-insensitively, as SharePoint does, and an attachment listed twice is
+    only kept once.
+    
+    Args:
+        attachments (list): Attachment objects of one ticket
+        
+    Returns:
+        list: (attachment, file name) pairs
+    """
+    named = []
+    used_names = {'ticket_metadata.json'}
+    seen_ids = set()
+    for attachment in attachments:
+        if attachment['id'] in seen_ids:
+            continue
+        seen_ids.add(attachment['id'])
+        
+        file_name = attachment_file_name(attachment)
+        while file_name.lower() in used_names:
+            file_name = f"{attachment['id']}_{file_name}"
+        used_names.add(file_name.lower())
+        named.append((attachment, file_name))
+    return named
+
+def download_one_attachment(client, attachment, ticket_dir, file_name=None):
+    """
+    Download a single attachment unless it is already on disk, logging instead of raising on failure
+    
+    Args:
+        client (FreshdeskClient): Freshdesk client
+        attachment (dict): Attachment object
+        ticket_dir (str): Directory to save the attachment
+        file_name (str): Name to save the attachment as (defaults to attachment_file_name)
+        
+    Returns:
+        str: Path to the downloaded file, or None if the download failed
+    """
+    attachment_id = attachment['id']
+    if file_name is None:
+        file_name = attachment_file_name(attachment)
+    
+    # Attachments never change, so a file of the expected size from an earlier run can be reused
+    if attachment.get('size') is not None:
+        existing_path = os.path.join(ticket_dir, file_name)
+        if os.path.isfile(existing_path) and os.path.getsize(existing_path) == attachment['size']:
+            logger.info(f"Attachment {attachment_id} already downloaded to {existing_path}")
+            return existing_path
+    
+    try:
+        file_path = client.download_attachment(attachment_id, ticket_dir, filename=file_name)
+        logger.info(f"Downloaded attachment {attachment_id} to {file_path}")
+        return file_path
+    except Exception as e:
+        logger.error(f"Failed to download attachment {attachment_id}: {e}")
+        return None
+
+def link_attachment(source_path, ticket_dir, file_name=None):
+    """
+    Reuse an attachment already downloaded for another ticket
+    
+    The file is hard-linked into the ticket directory, or copied when the
+    filesystem does not support hard links.
+    
+    Args:
+        source_path (str): Path to the downloaded attachment
+        ticket_dir (str): Directory of the ticket that also has the attachment
+        file_name (str): Name assigned to the attachment in this ticket by
+            assign_file_names (defaults to the name of the source file)
+        
+    Returns:
+        str: Path to the attachment in the ticket directory
+    """
+    file_path = os.path.join(ticket_dir, file_name or os.path.basename(source_path))
+    if os.path.abspath(file_path) == os.path.abspath(source_path):
+        return file_path
+    
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    try:
+        os.link(source_path, file_path)
+    except OSError:
+        shutil.copy2(source_path, file_path)
+    
+    logger.info(f"Linked duplicate attachment {source_path} to {file_path}")
+    return file_path
+
+def download_attachments_for_ticket(client, ticket, output_dir):
+    """
+    Download all attachments for a specific ticket
+    
+    Args:
+        client (FreshdeskClient): Freshdesk client
+        ticket (dict): Ticket object
+        output_dir (str): Directory to save attachments
+        
+    Returns:
+        list: List of paths to downloaded attachments
+    """
+    ticket_dir, attachments = prepare_ticket(client, ticket, output_dir)
     
     # Download each attachment
     downloaded_files = []
-    for attachment in attachments:
-        attachment_id = attachment['id']
-        try:
-            file_path = client.download_attachment(attachment_id, ticket_dir)
+    for attachment, file_name in assign_file_names(attachments):
+        file_path = download_one_attachment(client, attachment, ticket_dir, file_name)
+        if file_path:
             downloaded_files.append(file_path)
-            logger.info(f"Downloaded attachment {attachment_id} to {file_path}")
-        except Exception as e:
-            logger.error(f"Failed to download attachment {attachment_id}: {e}")
     
     return downloaded_files
 
-def main():
-    """Main function"""
-    args = parse_arguments()
+def download_attachments_for_tickets(client, tickets, output_dir, max_workers=32):
+    """
+    Download attachments for many tickets using a bounded pool of worker threads
+    
+    Ticket details are fetched first, then every attachment of every ticket is
+    downloaded as an independent job, so a ticket with many attachments does
+    not hold up the others.
+    
+    Args:
+        client (FreshdeskClient): Freshdesk client
+        tickets (list): List of ticket objects
+        output_dir (str): Directory to save attachments
+        max_workers (int): Maximum number of concurrent requests
+        
+    Returns:
+        dict: Mapping of ticket ID to the list of downloaded attachment paths
+    """
+    def fetch_ticket(ticket):
+        ticket_id = ticket['id']
+        logger.info(f"Processing ticket {ticket_id}: {ticket.get('subject', 'No subject')}")
+        return ticket_id, prepare_ticket(client, ticket, output_dir)
+    
+    def download_job(job):
+        ticket_id, ticket_dir, attachment, file_name = job
+        return ticket_id, attachment['id'], download_one_attachment(client, attachment, ticket_dir, file_name)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        prepared = list(executor.map(fetch_ticket, tickets))
+        
+        # Download each attachment ID once; later occurrences are linked to that copy.
+        # Names are made unique per ticket first, so no two jobs write the same file
+        downloaded = {ticket_id: [] for ticket_id, _ in prepared}
+        jobs = []
+        duplicates = []
+        scheduled = set()
+        for ticket_id, (ticket_dir, attachments) in prepared:
+            for attachment, file_name in assign_file_names(attachments):
+                if attachment['id'] in scheduled:
+                    duplicates.append((ticket_id, ticket_dir, attachment, file_name))
+                else:
+                    scheduled.add(attachment['id'])
+                    jobs.append((ticket_id, ticket_dir, attachment, file_name))
+        
+        seen = {}
+        for ticket_id, attachment_id, file_path in executor.map(download_job, jobs):
+            if file_path:
+                seen[attachment_id] = file_path
+                downloaded[ticket_id].append(file_path)
     
-    # Create Freshdesk client
-    client = FreshdeskClient(args.domain, args.api_key)
+    for ticket_id, ticket_dir, attachment, file_name in duplicates:
+        source_path = seen.get(attachment['id'])
+        if source_path:
+            downloaded[ticket_id].append(link_attachment(source_path, ticket_dir, file_name))
     
+    return downloaded
+
+def run(client, output_dir, tickets_file=None, max_workers=32):
+    """
+    Download attachments for all tickets
+    
+    Args:
+        client (FreshdeskClient): Freshdesk client
+        output_dir (str): Directory to save attachments
+        tickets_file (str): JSON file containing tickets (if not provided, will fetch tickets)
+        max_workers (int): Maximum number of concurrent downloads
+        
+    Returns:
+        dict: Mapping of ticket ID to the list of downloaded attachment paths
+    """
     # Get tickets (either from file or by fetching)
-    if args.tickets_file and os.path.exists(args.tickets_file):
-        tickets = load_tickets_from_file(args.tickets_file)
+    if tickets_file and os.path.exists(tickets_file):
+        tickets = load_tickets_from_file(tickets_file)
     else:
         logger.info("No tickets file provided or file not found. Retrieving tickets from Freshdesk...")
         tickets = client.get_all_tickets()
         logger.info(f"Retrieved {len(tickets)} tickets")
     
     # Create output directory if it doesn't exist
-    os.makedirs(args.output_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
     
-    # Download attachments for each ticket
-    total_attachments = 0
-    for ticket in tickets:
-        ticket_id = ticket['id']
-        logger.info(f"Processing ticket {ticket_id}: {ticket.get('subject', 'No subject')}")
-        
-        downloaded_files = download_attachments_for_ticket(client, ticket_id, args.output_dir)
-        total_attachments += len(downloaded_files)
+    # Download attachments for the tickets concurrently
+    downloaded = download_attachments_for_tickets(client, tickets, output_dir, max_workers)
+    total_attachments = sum(len(files) for files in downloaded.values())
     
     logger.info(f"Downloaded a total of {total_attachments} attachments for {len(tickets)} tickets")
     logger.info("Attachment download completed successfully")
+    return downloaded
+
+def main():
+    """Main function"""
+    args = parse_arguments()
+    
+    with FreshdeskClient(args.domain, args.api_key) as client:
+        run(client, args.output_dir, tickets_file=args.tickets_file, max_workers=args.workers)
 
 if __name__ == "__main__":
     main()
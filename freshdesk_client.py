@@ -3,9 +3,16 @@
 Freshdesk API Client for retrieving tickets and attachments
 """
 import os
-import json
+import re
+import time
+import shutil
+import threading
 import requests
-from urllib.parse import urljoin
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urljoin, unquote, urlparse, parse_qs
 import logging
 
 # Set up logging
@@ -15,6 +22,156 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# RFC 5987 encoded filename*=charset'language'value parameter of a Content-Disposition header
+_CD_FILENAME_EXT_RE = re.compile(r'filename\*\s*=\s*"?([^;"]+)"?', re.IGNORECASE)
+# Plain filename parameter, either quoted (and allowed to contain ';') or a bare token
+_CD_FILENAME_RE = re.compile(r'filename\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;\s]+))', re.IGNORECASE)
+
+def safe_filename(filename):
+    """
+    Reduce a file name received from Freshdesk to one that stays inside its directory
+    
+    Args:
+        filename (str): File name, possibly containing directory parts
+        
+    Returns:
+        str: Base name of the file, or None if no usable name is left
+    """
+    if not filename:
+        return None
+    
+    filename = os.path.basename(filename.replace('\\', '/')).strip()
+    if filename in ('', '.', '..'):
+        return None
+    return filename
+
+def _filename_from_content_disposition(content_disposition):
+    """
+    Get a safe local file name from a Content-Disposition header
+    
+    The RFC 5987 filename* form is preferred and is the only one percent-decoded.
+    Any directory part is stripped so the file cannot be written outside the
+    download directory.
+    
+    Args:
+        content_disposition (str): Content-Disposition header value
+        
+    Returns:
+        str: File name, or None if the header has no usable file name
+    """
+    filename = None
+    
+    match = _CD_FILENAME_EXT_RE.search(content_disposition)
+    if match:
+        charset, _, rest = match.group(1).strip().partition("'")
+        _, _, value = rest.partition("'")
+        if value:
+            try:
+                filename = unquote(value, encoding=charset or 'utf-8', errors='replace')
+            except LookupError:
+                filename = unquote(value, errors='replace')
+    
+    if not filename:
+        match = _CD_FILENAME_RE.search(content_disposition)
+        if match:
+            quoted, token = match.groups()
+            filename = re.sub(r'\\(.)', r'\1', quoted) if quoted is not None else token
+    
+    return safe_filename(filename)
+
+# Times a request answered with 429 is re-sent once the rate limiter's pause is over
+RATE_LIMIT_RETRIES = 8
+
+class RateLimiter:
+    """
+    Paces requests using the rate-limit headers returned by Freshdesk
+    
+    Freshdesk reports the calls left in the current one-minute window in
+    X-RateLimit-Remaining and asks clients to wait Retry-After seconds once
+    the limit is hit. The limiter is shared by all threads using a client.
+    """
+    def __init__(self, window=60, reserve=10):
+        """
+        Initialize the rate limiter
+        
+        Args:
+            window (int): Length of the rate-limit window in seconds
+            reserve (int): Remaining calls at or below which the budget is tracked
+        """
+        self.window = window
+        self.reserve = reserve
+        # Waiting threads are woken by update() so they re-check against new headers
+        self._condition = threading.Condition()
+        self._paused_until = 0.0
+        # Calls left in the current window once it is running low (None while plentiful)
+        self._budget = None
+        self._window_end = 0.0
+        
+    def _ready_at(self, now):
+        """
+        Time at which the next request may be sent (call with the lock held)
+        """
+        ready_at = self._paused_until
+        if self._budget is not None and self._budget <= 0 and now < self._window_end:
+            # The window's calls are spent, so wait for it to reset
+            ready_at = max(ready_at, self._window_end)
+        return ready_at
+        
+    def wait(self):
+        """
+        Block until the next request is allowed to be sent
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                ready_at = self._ready_at(now)
+                if ready_at <= now:
+                    break
+                self._condition.wait(ready_at - now)
+            
+            if self._budget is not None:
+                if now >= self._window_end:
+                    # A new window has started; the next response reports its budget
+                    self._budget = None
+                else:
+                    self._budget -= 1
+            
+    def update(self, response, *args, **kwargs):
+        """
+        Update the limiter from a response (usable as a requests response hook)
+        
+        Args:
+            response (requests.Response): Response received from Freshdesk
+        """
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        
+        with self._condition:
+            now = time.monotonic()
+            if response.status_code == 429:
+                try:
+                    retry_after = int(response.headers.get('Retry-After', 1))
+                except ValueError:
+                    retry_after = 1
+                logger.warning(f"Rate limit reached, pausing requests for {retry_after} seconds")
+                self._paused_until = max(self._paused_until, now + retry_after)
+                
+            if remaining is not None and remaining.isdigit():
+                remaining = int(remaining)
+                if remaining <= self.reserve:
+                    if self._budget is None or now >= self._window_end:
+                        # Running low: budget the calls left until the window resets
+                        self._budget = remaining
+                        self._window_end = now + self.window
+                    else:
+                        # Responses can arrive out of order, so keep the lowest count
+                        self._budget = min(self._budget, remaining)
+                else:
+                    # Plenty of calls left (the window has reset), so stop holding requests back
+                    self._budget = None
+                    self._window_end = 0.0
+                    
+            self._condition.notify_all()
+
 class FreshdeskClient:
     """
     Client for interacting with the Freshdesk API
@@ -35,7 +192,63 @@ class FreshdeskClient:
             'Content-Type': 'application/json'
         }
         
-    def _make_request(self, endpoint, method='GET', params=None, data=None):
+        # Reuse one session so repeated calls share pooled keep-alive connections
+        self.session = requests.Session()
+        self.session.auth = self.auth
+        self.session.headers.update(self.headers)
+        # Transient server failures are retried transparently by urllib3. 429 is left
+        # to the rate limiter, since response hooks never see responses urllib3 retries
+        retry = Retry(
+            total=8,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=frozenset(['GET', 'PUT', 'DELETE']),
+            raise_on_status=False
+        )
+        # Block when the pool is exhausted so concurrent callers share at most
+        # pool_maxsize connections to the Freshdesk host
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=64, max_retries=retry, pool_block=True)
+        self.session.mount('https://', adapter)
+        
+        # Track the API rate limit from every response the session receives
+        self.rate_limiter = RateLimiter()
+        self.session.hooks['response'].append(self.rate_limiter.update)
+        
+    def close(self):
+        """
+        Close the underlying HTTP session
+        """
+        self.session.close()
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
+    def _send(self, method, url, **kwargs):
+        """
+        Send a request through the rate limiter, retrying it when Freshdesk answers 429
+        
+        A 429 pauses the shared rate limiter for Retry-After seconds (through the
+        response hook), so every thread using the client waits before sending again.
+        
+        Args:
+            method (str): HTTP method
+            url (str): Request URL
+            **kwargs: Additional arguments for requests.Session.request
+            
+        Returns:
+            requests.Response: The first response that is not a 429, or the last 429
+        """
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            self.rate_limiter.wait()
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+                return response
+            response.close()
+        
+    def _make_request(self, endpoint, method='GET', params=None, data=None, return_headers=False):
         """
         Make a request to the Freshdesk API
         
@@ -44,43 +257,35 @@ class FreshdeskClient:
             method (str): HTTP method (GET, POST, PUT, DELETE)
             params (dict): Query parameters
             data (dict): Request body for POST/PUT requests
+            return_headers (bool): Also return the response headers
             
         Returns:
-            dict: Response data
+            dict: Response data, or a (data, headers) tuple if return_headers is set
         """
         url = urljoin(self.base_url, endpoint)
         
         try:
-            if method == 'GET':
-                response = requests.get(url, auth=self.auth, params=params, headers=self.headers)
-            elif method == 'POST':
-                response = requests.post(url, auth=self.auth, params=params, json=data, headers=self.headers)
-            elif method == 'PUT':
-                response = requests.put(url, auth=self.auth, params=params, json=data, headers=self.headers)
-            elif method == 'DELETE':
-                response = requests.delete(url, auth=self.auth, params=params, headers=self.headers)
+            if method in ('GET', 'DELETE'):
+                response = self._send(method, url, params=params)
+            elif method in ('POST', 'PUT'):
+                response = self._send(method, url, params=params, json=data)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
             
             response.raise_for_status()
             
             # Check if response is empty
-            if not response.content:
-                return {}
-                
-            return response.json()
+            result = response.json() if response.content else {}
+            
+            if return_headers:
+                return result, response.headers
+            return result
             
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"HTTP error: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                logger.error(f"Response content: {e.response.content}")
-            raise
         except requests.exceptions.RequestException as e:
+            # Retries are exhausted by the time an error reaches this point
             logger.error(f"Request error: {e}")
-            raise
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-            logger.error(f"Response content: {response.content}")
+            if e.response is not None:
+                logger.error(f"Response content: {e.response.content}")
             raise
             
     def get_tickets(self, page=1, per_page=100, **kwargs):
@@ -105,17 +310,43 @@ class FreshdeskClient:
         
         return self._make_request('tickets', params=params)
         
-    def get_ticket(self, ticket_id):
+    def get_ticket(self, ticket_id, include=None):
         """
         Get a specific ticket by ID
         
         Args:
             ticket_id (int): Ticket ID
+            include (str): Comma-separated related data to embed (e.g. 'conversations,requester')
             
         Returns:
             dict: Ticket object
         """
-        return self._make_request(f'tickets/{ticket_id}')
+        params = {'include': include} if include else None
+        return self._make_request(f'tickets/{ticket_id}', params=params)
+        
+    def get_ticket_conversations(self, ticket_id, per_page=100):
+        """
+        Get all conversations of a ticket using pagination
+        
+        Args:
+            ticket_id (int): Ticket ID
+            per_page (int): Number of conversations per page (max 100)
+            
+        Returns:
+            list: List of conversation objects
+        """
+        per_page = min(per_page, 100)
+        conversations = []
+        page = 1
+        while True:
+            batch = self._make_request(
+                f'tickets/{ticket_id}/conversations',
+                params={'page': page, 'per_page': per_page}
+            )
+            conversations.extend(batch)
+            if len(batch) < per_page:
+                return conversations
+            page += 1
         
     def get_ticket_attachments(self, ticket_id):
         """
@@ -130,13 +361,15 @@ class FreshdeskClient:
         ticket = self.get_ticket(ticket_id)
         return ticket.get('attachments', [])
         
-    def download_attachment(self, attachment_id, download_path):
+    def download_attachment(self, attachment_id, download_path, filename=None):
         """
         Download an attachment
         
         Args:
             attachment_id (int): Attachment ID
-            download_path (str): Path to save the attachment
+            download_path (str): Existing directory to save the attachment in
+            filename (str): Name to save the attachment as (if not provided, the name
+                from the Content-Disposition header is used)
             
         Returns:
             str: Path to the downloaded file
@@ -144,67 +377,119 @@ class FreshdeskClient:
         url = urljoin(self.base_url, f'attachments/{attachment_id}')
         
         try:
-            response = requests.get(url, auth=self.auth, stream=True)
-            response.raise_for_status()
-            
-            # Get the filename from the Content-Disposition header if available
-            content_disposition = response.headers.get('Content-Disposition')
-            filename = None
-            
-            if content_disposition:
-                import re
-                filename_match = re.search(r'filename="(.+?)"', content_disposition)
-                if filename_match:
-                    filename = filename_match.group(1)
-            
-            # If filename not found in header, use the attachment ID
-            if not filename:
-                filename = f"attachment_{attachment_id}"
+            # Closing the response returns its connection to the pool even on errors
+            with self._send('GET', url, stream=True) as response:
+                response.raise_for_status()
                 
-            file_path = os.path.join(download_path, filename)
-            
-            # Ensure the download directory exists
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                # Use the given filename, or the one from the Content-Disposition header if available
+                filename = safe_filename(filename)
+                content_disposition = response.headers.get('Content-Disposition')
+                
+                if not filename and content_disposition:
+                    filename = _filename_from_content_disposition(content_disposition)
+                
+                # If filename not found in header, use the attachment ID
+                if not filename:
+                    filename = f"attachment_{attachment_id}"
+                
+                # The caller is responsible for creating download_path
+                file_path = os.path.join(download_path, filename)
+                
+                # Write the file with a C-level copy loop, undoing any Content-Encoding
+                response.raw.decode_content = True
+                with open(file_path, 'wb') as f:
+                    shutil.copyfileobj(response.raw, f, length=1024 * 1024)
             
-            # Write the file
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    
             return file_path
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Error downloading attachment {attachment_id}: {e}")
             raise
 
-    def get_all_tickets(self, per_page=100):
+    def iter_ticket_pages(self, per_page=100, prefetch=1, **kwargs):
         """
-        Get all tickets using pagination
+        Iterate over pages of tickets, fetching the following pages in the background
+        
+        While the caller processes one page, requests for up to `prefetch` further
+        pages are already in flight. If the first response carries a Link header
+        with rel="last", no page beyond it is requested; otherwise iteration stops
+        at the first short page and any pages requested past it are discarded.
         
         Args:
             per_page (int): Number of tickets per page (max 100)
+            prefetch (int): Maximum number of page requests in flight
+            **kwargs: Additional filter parameters
             
-        Returns:
-            list: List of all ticket objects
+        Yields:
+            list: List of ticket objects in the page
         """
-        all_tickets = []
-        page = 1
-        more_tickets = True
+        per_page = min(per_page, 100)
+        
+        logger.info("Fetching tickets page 1")
+        params = {'page': 1, 'per_page': per_page}
+        params.update(kwargs)
+        tickets, headers = self._make_request('tickets', params=params, return_headers=True)
+        last_page = self._parse_last_page(headers)
         
-        while more_tickets:
-            logger.info(f"Fetching tickets page {page}")
-            tickets = self.get_tickets(page=page, per_page=per_page)
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            pending = deque()
+            next_page = 2
             
-            if not tickets:
-                more_tickets = False
-            else:
-                all_tickets.extend(tickets)
-                
-                # Check if we've reached the last page
+            while True:
+                # Request the following pages before handing this one to the caller
                 if len(tickets) < per_page:
-                    more_tickets = False
+                    for future in pending:
+                        future.cancel()
+                    pending.clear()
                 else:
-                    page += 1
+                    while len(pending) < prefetch and (last_page is None or next_page <= last_page):
+                        logger.info(f"Fetching tickets page {next_page}")
+                        pending.append(executor.submit(self.get_tickets, page=next_page, per_page=per_page, **kwargs))
+                        next_page += 1
+                
+                if tickets:
+                    yield tickets
+                
+                if not pending:
+                    break
+                tickets = pending.popleft().result()
+
+    @staticmethod
+    def _parse_last_page(headers):
+        """
+        Get the last page number from an RFC 5988 Link header, if advertised
+        
+        Args:
+            headers (dict): Response headers
+            
+        Returns:
+            int: Last page number, or None if unknown
+        """
+        link_header = headers.get('Link')
+        if not link_header:
+            return None
+        
+        for link in requests.utils.parse_header_links(link_header):
+            if link.get('rel') == 'last':
+                page = parse_qs(urlparse(link['url']).query).get('page')
+                if page and page[0].isdigit():
+                    return int(page[0])
+        return None
+
+    def get_all_tickets(self, per_page=100, prefetch=1):
+        """
+        Get all tickets using pagination
+        
+        Args:
+            per_page (int): Number of tickets per page (max 100)
+            prefetch (int): Maximum number of page requests in flight
+            
+        Returns:
+            list: List of all ticket objects
+        """
+        all_tickets = []
+        for tickets in self.iter_ticket_pages(per_page=per_page, prefetch=prefetch):
+            all_tickets.extend(tickets)
                     
         logger.info(f"Retrieved {len(all_tickets)} tickets in total")
         return all_tickets
@@ -212,16 +497,15 @@ class FreshdeskClient:
 # Example usage
 if __name__ == "__main__":
     # Replace with your actual Freshdesk domain and API key
-    client = FreshdeskClient("your-domain.freshdesk.com", "your-api-key")
-    
-    # Get all tickets
-    tickets = client.get_all_tickets()
-    print(f"Retrieved {len(tickets)} tickets")
-    
-    # Get attachments for the first ticket (if any)
-    if tickets:
-        first_ticket = tickets[0]
-        print(f"First ticket: {first_ticket['id']} - {first_ticket['subject']}")
+    with FreshdeskClient("your-domain.freshdesk.com", "your-api-key") as client:
+        # Get all tickets
+        tickets = client.get_all_tickets()
+        print(f"Retrieved {len(tickets)} tickets")
         
-        attachments = client.get_ticket_attachments(first_ticket['id'])
-        print(f"Found {len(attachments)} attachments for ticket {first_ticket['id']}")
+        # Get attachments for the first ticket (if any)
+        if tickets:
+            first_ticket = tickets[0]
+            print(f"First ticket: {first_ticket['id']} - {first_ticket['subject']}")
+            
+            attachments = client.get_ticket_attachments(first_ticket['id'])
+            print(f"Found {len(attachments)} attachments for ticket {first_ticket['id']}")
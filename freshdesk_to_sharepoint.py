@@ -9,15 +9,21 @@ import logging
 import json
 import time
 from datetime import datetime
+import retrieve_tickets
+import download_attachments
+import upload_to_sharepoint
+from freshdesk_client import FreshdeskClient
+from sharepoint_client import SharePointClient
 
-# Set up logging
+# Set up logging (force replaces the console-only setup done by the imported modules)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler("freshdesk_to_sharepoint.log"),
         logging.StreamHandler()
-    ]
+    ],
+    force=True
 )
 logger = logging.getLogger(__name__)
 
@@ -50,19 +56,24 @@ def create_directories(base_dir):
     
     return tickets_dir, attachments_dir
 
-def run_command(command):
-    """Run a command and log the output"""
-    logger.info(f"Running command: {command}")
+def run_step(description, func, *args, **kwargs):
+    """
+    Run a step of the migration and log its outcome
+    
+    Returns:
+        tuple: Whether the step succeeded and the value returned by the step
+    """
+    logger.info(f"Running step: {description}")
     start_time = time.time()
-    exit_code = os.system(command)
+    try:
+        result = func(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Step failed: {description}")
+        return False, None
     duration = time.time() - start_time
     
-    if exit_code == 0:
-        logger.info(f"Command completed successfully in {duration:.2f} seconds")
-    else:
-        logger.error(f"Command failed with exit code {exit_code}")
-    
-    return exit_code == 0
+    logger.info(f"Step completed successfully in {duration:.2f} seconds")
+    return True, result
 
 def main():
     """Main function"""
@@ -75,51 +86,54 @@ def main():
     start_time = datetime.now()
     logger.info(f"Starting Freshdesk to SharePoint migration at {start_time}")
     
-    # Step 1: Retrieve tickets from Freshdesk
-    logger.info("Step 1: Retrieving tickets from Freshdesk")
-    retrieve_tickets_cmd = (
-        f"python3 retrieve_tickets.py "
-        f"--domain {args.freshdesk_domain} "
-        f"--api-key {args.freshdesk_api_key} "
-        f"--output-dir {tickets_dir}"
-    )
-    if not run_command(retrieve_tickets_cmd):
-        logger.error("Failed to retrieve tickets from Freshdesk")
-        return
-    
-    # Step 2: Download attachments
-    logger.info("Step 2: Downloading attachments")
-    # Find the latest tickets file
-    json_files = [f for f in os.listdir(tickets_dir) if f.startswith('tickets_') and f.endswith('.json')]
-    if not json_files:
-        logger.error(f"No ticket files found in {tickets_dir}")
+    # Create the SharePoint client up front so it is shared by the upload step
+    try:
+        sharepoint_client = SharePointClient(args.sharepoint_url, args.sharepoint_username, args.sharepoint_password)
+    except Exception:
+        logger.exception("Failed to connect to SharePoint")
         return
     
-    latest_tickets_file = os.path.join(tickets_dir, sorted(json_files)[-1])
-    
-    download_attachments_cmd = (
-        f"python3 download_attachments.py "
-        f"--domain {args.freshdesk_domain} "
-        f"--api-key {args.freshdesk_api_key} "
-        f"--tickets-file {latest_tickets_file} "
-        f"--output-dir {attachments_dir}"
-    )
-    if not run_command(download_attachments_cmd):
-        logger.error("Failed to download attachments")
-        return
-    
-    # Step 3: Upload to SharePoint
-    logger.info("Step 3: Uploading to SharePoint")
-    upload_to_sharepoint_cmd = (
-        f"python3 upload_to_sharepoint.py "
-        f"--site-url {args.sharepoint_url} "
-        f"--username {args.sharepoint_username} "
-        f"--password {args.sharepoint_password} "
-        f"--tickets-dir {tickets_dir} "
-        f"--attachments-dir {attachments_dir} "
-        f"--sharepoint-folder {args.sharepoint_folder}"
-    )
-    if not run_command(upload_to_sharepoint_cmd):
+    # The SharePoint client is closed however the migration ends
+    with sharepoint_client:
+        with FreshdeskClient(args.freshdesk_domain, args.freshdesk_api_key) as freshdesk_client:
+            # Step 1: Retrieve tickets from Freshdesk
+            logger.info("Step 1: Retrieving tickets from Freshdesk")
+            ok, latest_tickets_file = run_step(
+                "retrieve tickets",
+                retrieve_tickets.run,
+                freshdesk_client,
+                tickets_dir
+            )
+            if not ok:
+                logger.error("Failed to retrieve tickets from Freshdesk")
+                return
+            
+            # Step 2: Download attachments
+            logger.info("Step 2: Downloading attachments")
+            ok, downloaded = run_step(
+                "download attachments",
+                download_attachments.run,
+                freshdesk_client,
+                attachments_dir,
+                tickets_file=latest_tickets_file
+            )
+            if not ok:
+                logger.error("Failed to download attachments")
+                return
+        
+        # Step 3: Upload to SharePoint
+        logger.info("Step 3: Uploading to SharePoint")
+        ok, results = run_step(
+            "upload to SharePoint",
+            upload_to_sharepoint.run,
+            sharepoint_client,
+            tickets_dir,
+            attachments_dir,
+            args.sharepoint_folder,
+            tickets_file=latest_tickets_file,
+            downloaded=downloaded
+        )
+    if not ok:
         logger.error("Failed to upload to SharePoint")
         return
     
@@ -127,65 +141,55 @@ def main():
     end_time = datetime.now()
     duration = end_time - start_time
     
-    # Load upload results
-    upload_results_file = os.path.join(tickets_dir, "upload_results.json")
-    if os.path.exists(upload_results_file):
-        with open(upload_results_file, 'r') as f:
-            results = json.load(f)
+    # Summarise the upload results
+    total_tickets, total_attachments_success, total_attachments_failed = upload_to_sharepoint.summarize_results(results)
+    
+    # Generate summary report
+    summary = {
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'duration_seconds': duration.total_seconds(),
+        'total_tickets': total_tickets,
+        'total_attachments_success': total_attachments_success,
+        'total_attachments_failed': total_attachments_failed,
+        'freshdesk_domain': args.freshdesk_domain,
+        'sharepoint_url': args.sharepoint_url,
+        'sharepoint_folder': args.sharepoint_folder
+    }
+    
+    # Save summary report
+    summary_file = os.path.join(args.data_dir, "migration_summary.json")
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+    
+    logger.info(f"Migration completed in {duration}")
+    logger.info(f"Total tickets: {total_tickets}")
+    logger.info(f"Total attachments uploaded: {total_attachments_success}")
+    logger.info(f"Total attachments failed: {total_attachments_failed}")
+    logger.info(f"Summary saved to {summary_file}")
+    
+    # Generate a human-readable report
+    report_file = os.path.join(args.data_dir, "migration_report.txt")
+    with open(report_file, 'w') as f:
+        f.write("Freshdesk to SharePoint Migration Report\n")
+        f.write("=======================================\n\n")
+        f.write(f"Start time: {start_time}\n")
+        f.write(f"End time: {end_time}\n")
+        f.write(f"Duration: {duration}\n\n")
+        f.write(f"Freshdesk domain: {args.freshdesk_domain}\n")
+        f.write(f"SharePoint site: {args.sharepoint_url}\n")
+        f.write(f"SharePoint folder: {args.sharepoint_folder}\n\n")
+        f.write(f"Total tickets processed: {total_tickets}\n")
+        f.write(f"Total attachments uploaded: {total_attachments_success}\n")
+        f.write(f"Total attachments failed: {total_attachments_failed}\n\n")
         
-        total_tickets = len(results)
-        total_attachments_success = sum(r['attachments']['success'] for r in results)
-        total_attachments_failed = sum(r['attachments']['failed'] for r in results)
-        
-        # Generate summary report
-        summary = {
-            'start_time': start_time.isoformat(),
-            'end_time': end_time.isoformat(),
-            'duration_seconds': duration.total_seconds(),
-            'total_tickets': total_tickets,
-            'total_attachments_success': total_attachments_success,
-            'total_attachments_failed': total_attachments_failed,
-            'freshdesk_domain': args.freshdesk_domain,
-            'sharepoint_url': args.sharepoint_url,
-            'sharepoint_folder': args.sharepoint_folder
-        }
-        
-        # Save summary report
-        summary_file = os.path.join(args.data_dir, "migration_summary.json")
-        with open(summary_file, 'w') as f:
-            json.dump(summary, f, indent=2)
-        
-        logger.info(f"Migration completed in {duration}")
-        logger.info(f"Total tickets: {total_tickets}")
-        logger.info(f"Total attachments uploaded: {total_attachments_success}")
-        logger.info(f"Total attachments failed: {total_attachments_failed}")
-        logger.info(f"Summary saved to {summary_file}")
-        
-        # Generate a human-readable report
-        report_file = os.path.join(args.data_dir, "migration_report.txt")
-        with open(report_file, 'w') as f:
-            f.write("Freshdesk to SharePoint Migration Report\n")
-            f.write("=======================================\n\n")
-            f.write(f"Start time: {start_time}\n")
-            f.write(f"End time: {end_time}\n")
-            f.write(f"Duration: {duration}\n\n")
-            f.write(f"Freshdesk domain: {args.freshdesk_domain}\n")
-            f.write(f"SharePoint site: {args.sharepoint_url}\n")
-            f.write(f"SharePoint folder: {args.sharepoint_folder}\n\n")
-            f.write(f"Total tickets processed: {total_tickets}\n")
-            f.write(f"Total attachments uploaded: {total_attachments_success}\n")
-            f.write(f"Total attachments failed: {total_attachments_failed}\n\n")
-            
-            f.write("Ticket Details:\n")
-            f.write("--------------\n")
-            for ticket in results:
-                f.write(f"Ticket {ticket['ticket_id']}: {ticket['subject']}\n")
-                f.write(f"  Attachments: {ticket['attachments']['success']} uploaded, {ticket['attachments']['failed']} failed\n")
-        
-        logger.info(f"Detailed report saved to {report_file}")
-    else:
-        logger.warning(f"Upload results file not found: {upload_results_file}")
-        logger.info(f"Migration completed in {duration}")
+        f.write("Ticket Details:\n")
+        f.write("--------------\n")
+        for ticket in results:
+            f.write(f"Ticket {ticket['ticket_id']}: {ticket['subject']}\n")
+            f.write(f"  Attachments: {ticket['attachments']['success']} uploaded, {ticket['attachments']['failed']} failed\n")
+    
+    logger.info(f"Detailed report saved to {report_file}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+JSON helpers that use orjson and ijson when they are installed and fall back to the standard library
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+def dumps(obj, indent=False):
+    """
+    Serialize an object to JSON
+    
+    Args:
+        obj: Object to serialize
+        indent (bool): Indent with two spaces instead of writing compact JSON
+        
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    
+    if indent:
+        return json.dumps(obj, indent=2).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def loads(data):
+    """
+    Deserialize JSON
+    
+    Args:
+        data (bytes or str): JSON document
+        
+    Returns:
+        Deserialized object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def iter_array_file(file_path):
+    """
+    Iterate over the items of a JSON array stored in a file
+    
+    With ijson installed the items are parsed one at a time, so the whole
+    array is never held in memory; otherwise the file is loaded at once.
+    
+    Args:
+        file_path (str): Path to a file containing a JSON array
+        
+    Yields:
+        Deserialized array items
+    """
+    with open(file_path, 'rb') as f:
+        if ijson is not None:
+            yield from ijson.items(f, 'item', use_float=True)
+        else:
+            yield from loads(f.read())
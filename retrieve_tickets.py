@@ -3,10 +3,10 @@
 Script to retrieve all tickets from Freshdesk
 """
 import os
-import json
 import argparse
 import logging
 from datetime import datetime
+import json_utils
 from freshdesk_client import FreshdeskClient
 
 # Set up logging
@@ -23,18 +23,24 @@ def parse_arguments():
     parser.add_argument('--api-key', required=True, help='Freshdesk API key')
     parser.add_argument('--output-dir', default='./data', help='Directory to save ticket data')
     parser.add_argument('--per-page', type=int, default=100, help='Number of tickets per page (max 100)')
+    parser.add_argument('--page-workers', type=int, default=4, help='Number of ticket pages to fetch concurrently')
     return parser.parse_args()
 
-def save_tickets_to_file(tickets, output_dir):
+def save_tickets_to_file(ticket_pages, output_dir):
     """
-    Save tickets to a JSON file
+    Stream pages of tickets to a JSON file and write the ticket index alongside
+    
+    Tickets are written as the pages arrive, one compact ticket per line of a
+    JSON array, so memory use does not grow with the number of tickets. Both
+    files are written under a .part name and only moved into place once every
+    page has been retrieved, so a failed retrieval leaves the previous files intact.
     
     Args:
-        tickets (list): List of ticket objects
-        output_dir (str): Directory to save the file
+        ticket_pages (iterable): Pages of ticket objects
+        output_dir (str): Directory to save the files
         
     Returns:
-        str: Path to the saved file
+        tuple: Path to the saved tickets file and the number of tickets saved
     """
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
@@ -44,36 +50,75 @@ def save_tickets_to_file(tickets, output_dir):
     filename = f"tickets_{timestamp}.json"
     file_path = os.path.join(output_dir, filename)
     
-    # Save tickets to file
-    with open(file_path, 'w') as f:
-        json.dump(tickets, f, indent=2)
+    # Create a ticket index file with just IDs and subjects for easier reference
+    index_file = os.path.join(output_dir, 'ticket_index.json')
+    
+    partial_file = f"{file_path}.part"
+    partial_index_file = f"{index_file}.part"
+    
+    count = 0
+    try:
+        with open(partial_file, 'wb') as tickets_f, open(partial_index_file, 'wb') as index_f:
+            # Bind the per-ticket calls to locals once
+            write_ticket = tickets_f.write
+            write_index = index_f.write
+            dumps = json_utils.dumps
+            
+            write_ticket(b'[')
+            write_index(b'[')
+            separator = b'\n'
+            for tickets in ticket_pages:
+                for ticket in tickets:
+                    write_ticket(separator + dumps(ticket))
+                    write_index(separator + dumps({'id': ticket['id'], 'subject': ticket['subject']}))
+                    separator = b',\n'
+                count += len(tickets)
+            write_ticket(b'\n]\n')
+            write_index(b'\n]\n')
+        
+        os.replace(partial_file, file_path)
+        os.replace(partial_index_file, index_file)
+    except BaseException:
+        # Don't leave truncated files behind
+        for path in (partial_file, partial_index_file):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        raise
         
-    logger.info(f"Saved {len(tickets)} tickets to {file_path}")
-    return file_path
+    logger.info(f"Saved {count} tickets to {file_path}")
+    logger.info(f"Saved ticket index to {index_file}")
+    return file_path, count
 
-def main():
-    """Main function"""
-    args = parse_arguments()
-    
-    # Create Freshdesk client
-    client = FreshdeskClient(args.domain, args.api_key)
+def run(client, output_dir, per_page=100, page_workers=4):
+    """
+    Retrieve all tickets from Freshdesk and save them to a file
     
-    # Get all tickets
+    Args:
+        client (FreshdeskClient): Freshdesk client
+        output_dir (str): Directory to save ticket data
+        per_page (int): Number of tickets per page (max 100)
+        page_workers (int): Number of ticket pages to fetch concurrently
+        
+    Returns:
+        str: Path to the saved tickets file
+    """
+    # Get all tickets, saving each page as it is retrieved
     logger.info("Retrieving all tickets from Freshdesk...")
-    tickets = client.get_all_tickets(per_page=args.per_page)
-    logger.info(f"Retrieved {len(tickets)} tickets")
-    
-    # Save tickets to file
-    tickets_file = save_tickets_to_file(tickets, args.output_dir)
-    
-    # Create a ticket index file with just IDs and subjects for easier reference
-    ticket_index = [{'id': ticket['id'], 'subject': ticket['subject']} for ticket in tickets]
-    index_file = os.path.join(args.output_dir, 'ticket_index.json')
-    with open(index_file, 'w') as f:
-        json.dump(ticket_index, f, indent=2)
+    ticket_pages = client.iter_ticket_pages(per_page=per_page, prefetch=page_workers)
+    tickets_file, count = save_tickets_to_file(ticket_pages, output_dir)
+    logger.info(f"Retrieved {count} tickets")
     
-    logger.info(f"Saved ticket index to {index_file}")
     logger.info("Ticket retrieval completed successfully")
+    return tickets_file
+
+def main():
+    """Main function"""
+    args = parse_arguments()
+    
+    with FreshdeskClient(args.domain, args.api_key) as client:
+        run(client, args.output_dir, per_page=args.per_page, page_workers=args.page_workers)
 
 if __name__ == "__main__":
     main()
@@ -3,7 +3,13 @@
 SharePoint client for uploading files and creating folders
 """
 import os
+import time
+import random
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
 from office365.runtime.auth.user_credential import UserCredential
 from office365.sharepoint.client_context import ClientContext
 from office365.sharepoint.files.file import File
@@ -15,11 +21,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Files larger than this are uploaded through an upload session
+UPLOAD_SESSION_THRESHOLD = 10 * 1024 * 1024
+
+# Size of each chunk sent by an upload session, and so the memory held per large upload
+UPLOAD_CHUNK_SIZE = 2 * 1024 * 1024
+
+# Throttling and transient server errors that are retried with exponential backoff
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+RETRY_ATTEMPTS = 6
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+
 class SharePointClient:
     """
     Client for interacting with SharePoint
     """
-    def __init__(self, site_url, username, password):
+    def __init__(self, site_url, username, password, max_workers=16, chunk_size=UPLOAD_CHUNK_SIZE):
         """
         Initialize the SharePoint client
         
@@ -27,25 +45,129 @@ class SharePointClient:
             site_url (str): SharePoint site URL
             username (str): SharePoint username
             password (str): SharePoint password
+            max_workers (int): Maximum number of concurrent file uploads
+            chunk_size (int): Chunk size in bytes for files uploaded through an upload session
         """
         self.site_url = site_url
         self.username = username
         self.password = password
-        self.ctx = None
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        # ClientContext is not thread-safe, so each thread gets its own
+        self._local = threading.local()
+        # Folders known to exist, so each one is only checked once
+        self._folder_cache = set()
+        # Per-folder locks so threads racing on the same folder issue one request
+        self._folder_locks = {}
+        # Server-relative URLs of uploaded files, keyed by local (device, inode)
+        self._uploaded_files = {}
+        # Upload threads are kept for the life of the client so their contexts are reused
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # One session shared by every thread's context, so uploads reuse pooled
+        # keep-alive connections instead of paying a TLS handshake per context
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=64, pool_block=True)
+        self.session.mount('https://', adapter)
         self.connect()
         
+    def close(self):
+        """
+        Shut down the upload worker threads and close the HTTP session
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        self.session.close()
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
+    def _get_executor(self):
+        """
+        Get the shared pool of upload worker threads, creating it on first use
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+        
+    @property
+    def ctx(self):
+        """
+        SharePoint client context for the calling thread
+        """
+        if getattr(self._local, 'ctx', None) is None:
+            self.connect()
+        return self._local.ctx
+        
     def connect(self):
         """
         Connect to SharePoint
         """
         try:
             user_credentials = UserCredential(self.username, self.password)
-            self.ctx = ClientContext(self.site_url).with_credentials(user_credentials)
+            self._local.ctx = (
+                ClientContext(self.site_url)
+                .with_credentials(user_credentials)
+                .with_transport(session=self.session)
+            )
             logger.info(f"Connected to SharePoint site: {self.site_url}")
         except Exception as e:
             logger.error(f"Failed to connect to SharePoint: {e}")
             raise
             
+    def _execute_with_retry(self, operation):
+        """
+        Run a SharePoint operation, retrying throttled and transient failures
+        
+        The delay doubles on every attempt with random jitter, so throttled
+        workers do not retry in lockstep, and never undercuts Retry-After.
+        
+        Args:
+            operation (callable): Function that queues and executes the requests
+            
+        Returns:
+            The return value of operation
+        """
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                return operation()
+            except requests.RequestException as e:
+                response = getattr(e, 'response', None)
+                status_code = getattr(response, 'status_code', None)
+                transient = isinstance(e, (requests.ConnectionError, requests.Timeout))
+                if attempt == RETRY_ATTEMPTS or not (transient or status_code in RETRY_STATUS_CODES):
+                    raise
+                
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)) * (0.5 + random.random())
+                retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                logger.warning(f"SharePoint request failed ({status_code or e}), retrying in {delay:.1f}s (attempt {attempt}/{RETRY_ATTEMPTS})")
+                
+                # Drop this thread's context along with its failed queries; the ctx
+                # property reconnects with the credentials and shared session
+                self._local.ctx = None
+                time.sleep(delay)
+            
+    @staticmethod
+    def _normalize_folder_path(folder_path):
+        """
+        Normalize a folder path so equivalent spellings share one cache entry
+        
+        Args:
+            folder_path (str): Relative path of a folder
+            
+        Returns:
+            str: Path with '/' separators and no leading, trailing or repeated slashes
+        """
+        return '/'.join(part for part in folder_path.replace('\\', '/').split('/') if part)
+        
     def create_folder(self, folder_path):
         """
         Create a folder in SharePoint
@@ -56,29 +178,38 @@ class SharePointClient:
         Returns:
             bool: True if successful, False otherwise
         """
+        folder_path = self._normalize_folder_path(folder_path)
+        if folder_path in self._folder_cache:
+            return True
+            
         try:
             # Split the path into parts to create each level
-            parts = folder_path.strip('/').split('/')
+            parts = folder_path.split('/')
             current_path = ""
             
             for part in parts:
-                if not part:
-                    continue
-                    
                 current_path = f"{current_path}/{part}" if current_path else part
+                if current_path in self._folder_cache:
+                    continue
                 
-                # Check if folder exists
-                folder_url = current_path
-                try:
-                    folder = self.ctx.web.get_folder_by_server_relative_url(folder_url)
-                    self.ctx.load(folder)
-                    self.ctx.execute_query()
-                    logger.debug(f"Folder already exists: {folder_url}")
-                except Exception:
-                    # Folder doesn't exist, create it
-                    folder = self.ctx.web.folders.add(folder_url)
-                    self.ctx.execute_query()
-                    logger.info(f"Created folder: {folder_url}")
+                # setdefault is atomic, so every thread gets the same lock for a path
+                with self._folder_locks.setdefault(current_path, threading.Lock()):
+                    # Another thread may have created the folder while this one waited
+                    if current_path in self._folder_cache:
+                        continue
+                    
+                    # Check if folder exists
+                    folder_url = current_path
+                    try:
+                        self._execute_with_retry(
+                            lambda: self.ctx.web.get_folder_by_server_relative_url(folder_url).get().execute_query()
+                        )
+                        logger.debug(f"Folder already exists: {folder_url}")
+                    except Exception:
+                        # Folder doesn't exist, create it
+                        self._execute_with_retry(lambda: self.ctx.web.folders.add(folder_url).execute_query())
+                        logger.info(f"Created folder: {folder_url}")
+                    self._folder_cache.add(current_path)
             
             return True
         except Exception as e:
@@ -97,7 +228,7 @@ class SharePointClient:
             bool: True if successful, False otherwise
         """
         try:
-            # Ensure the folder exists
+            # Ensure the folder exists (a cache lookup once it has been created)
             self.create_folder(sharepoint_folder_path)
             
             # Get the filename from the local path
@@ -108,13 +239,32 @@ class SharePointClient:
             if not target_folder_url.startswith('/'):
                 target_folder_url = f"/{target_folder_url}"
                 
-            # Read the file content
-            with open(local_file_path, 'rb') as file_content:
-                content = file_content.read()
-                
-            # Upload the file
             target_file_url = f"{target_folder_url}/{file_name}"
-            File.save_binary(self.ctx, target_file_url, content)
+            
+            # A hard link to a file uploaded earlier is copied server-side instead of re-uploaded
+            file_stat = os.stat(local_file_path)
+            file_key = (file_stat.st_dev, file_stat.st_ino)
+            source_file_url = self._uploaded_files.get(file_key) if file_stat.st_nlink > 1 else None
+            if source_file_url and source_file_url != target_file_url:
+                if self._copy_file(source_file_url, target_folder_url, file_name):
+                    return True
+            
+            if file_stat.st_size > UPLOAD_SESSION_THRESHOLD:
+                # Stream large files in chunks rather than reading them into memory
+                def upload():
+                    target_folder = self.ctx.web.get_folder_by_server_relative_url(target_folder_url)
+                    target_folder.files.create_upload_session(
+                        local_file_path,
+                        self.chunk_size,
+                        lambda offset, **kwargs: logger.debug(f"Uploaded {offset} bytes of {file_name}")
+                    ).execute_query()
+            else:
+                # Upload the file, letting requests stream the body from the open file
+                def upload():
+                    with open(local_file_path, 'rb') as file_content:
+                        File.save_binary(self.ctx, target_file_url, file_content)
+            self._execute_with_retry(upload)
+            self._uploaded_files[file_key] = target_file_url
             logger.info(f"Uploaded file {file_name} to {target_folder_url}")
             
             return True
@@ -122,6 +272,96 @@ class SharePointClient:
             logger.error(f"Failed to upload file {local_file_path}: {e}")
             return False
             
+    def upload_bytes(self, data, sharepoint_folder_path, file_name):
+        """
+        Upload in-memory content to SharePoint as a file
+        
+        Args:
+            data (bytes): File content
+            sharepoint_folder_path (str): Relative path of the SharePoint folder
+            file_name (str): Name of the file to create or overwrite
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            # Ensure the folder exists (a cache lookup once it has been created)
+            self.create_folder(sharepoint_folder_path)
+            
+            target_folder_url = f"/{self._normalize_folder_path(sharepoint_folder_path)}"
+            self._execute_with_retry(
+                lambda: self.ctx.web.get_folder_by_server_relative_url(target_folder_url)
+                .files.add(file_name, data, True).execute_query()
+            )
+            logger.info(f"Uploaded file {file_name} to {target_folder_url}")
+            
+            return True
+        except Exception as e:
+            logger.error(f"Failed to upload file {file_name} to {sharepoint_folder_path}: {e}")
+            return False
+            
+    def _copy_file(self, source_file_url, target_folder_url, file_name):
+        """
+        Copy a file that is already in SharePoint to another folder
+        
+        Args:
+            source_file_url (str): Server-relative URL of the existing file
+            target_folder_url (str): Server-relative URL of the destination folder
+            file_name (str): Name of the copy
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            self._execute_with_retry(
+                lambda: self.ctx.web.get_file_by_server_relative_url(source_file_url)
+                .copyto(target_folder_url, True, file_name).execute_query()
+            )
+            logger.info(f"Copied file {file_name} to {target_folder_url} from {source_file_url}")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to copy {source_file_url}, uploading it instead: {e}")
+            return False
+            
+    def add_folders_with_files(self, items, batch_size=100):
+        """
+        Create folders and upload small in-memory files using $batch requests
+        
+        Each item adds a folder and a file inside it. Up to batch_size operations
+        are sent to SharePoint in a single request. The parent of every folder must
+        already exist. Binary attachments should use upload_file instead.
+        
+        Args:
+            items (list): (folder path, file name, file content bytes) tuples
+            batch_size (int): Maximum number of operations per batch request
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        def add_items():
+            # Looked up on every attempt, as a retry replaces the thread's context
+            ctx = self.ctx
+            for folder_path, file_name, content in items:
+                folder_path = self._normalize_folder_path(folder_path)
+                if folder_path not in self._folder_cache:
+                    ctx.web.folders.add(folder_path)
+                ctx.web.get_folder_by_server_relative_url(f"/{folder_path}").files.add(file_name, content, True)
+            ctx.execute_batch(items_per_batch=batch_size)
+            
+        try:
+            self._execute_with_retry(add_items)
+            
+            for folder_path, _, _ in items:
+                self._folder_cache.add(self._normalize_folder_path(folder_path))
+            logger.info(f"Created {len(items)} folders with files in batch requests")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to create {len(items)} folders with files in batch requests: {e}")
+            # Drop this thread's context along with the queued operations; the
+            # ctx property reconnects with the credentials and shared session
+            self._local.ctx = None
+            return False
+            
     def upload_folder_contents(self, local_folder_path, sharepoint_folder_path):
         """
         Upload all files in a local folder to SharePoint
@@ -130,6 +370,36 @@ class SharePointClient:
             local_folder_path (str): Path to the local folder
             sharepoint_folder_path (str): Relative path of the SharePoint folder
             
+        Returns:
+            dict: Dictionary with counts of successful and failed uploads
+        """
+        # Ensure the folder exists
+        self.create_folder(sharepoint_folder_path)
+        
+        # Walk through the local folder, collecting the files to upload
+        uploads = []
+        for root, dirs, files in os.walk(local_folder_path):
+            # Calculate the relative path from the base folder
+            rel_path = os.path.relpath(root, local_folder_path)
+            if rel_path == '.':
+                target_folder = sharepoint_folder_path
+            else:
+                target_folder = f"{sharepoint_folder_path}/{rel_path}"
+            
+            for file in files:
+                uploads.append((os.path.join(root, file), target_folder))
+        
+        results = self.upload_files(uploads)
+        logger.info(f"Uploaded {results['success']} files to {sharepoint_folder_path}, {results['failed']} failed")
+        return results
+        
+    def upload_files(self, uploads):
+        """
+        Upload a list of local files to their SharePoint folders
+        
+        Args:
+            uploads (list): (local file path, SharePoint folder path) pairs
+            
         Returns:
             dict: Dictionary with counts of successful and failed uploads
         """
@@ -139,38 +409,28 @@ class SharePointClient:
             'files': []
         }
         
-        # Ensure the folder exists
-        self.create_folder(sharepoint_folder_path)
+        # Ensure each target folder exists once, parents before children
+        for target_folder in sorted({target_folder for _, target_folder in uploads}):
+            self.create_folder(target_folder)
         
-        # Walk through the local folder
-        for root, dirs, files in os.walk(local_folder_path):
-            for file in files:
-                local_file_path = os.path.join(root, file)
-                
-                # Calculate the relative path from the base folder
-                rel_path = os.path.relpath(root, local_folder_path)
-                if rel_path == '.':
-                    target_folder = sharepoint_folder_path
-                else:
-                    target_folder = f"{sharepoint_folder_path}/{rel_path}"
-                
-                # Upload the file
-                success = self.upload_file(local_file_path, target_folder)
-                
-                if success:
-                    results['success'] += 1
-                    results['files'].append({
-                        'path': local_file_path,
-                        'status': 'success'
-                    })
-                else:
-                    results['failed'] += 1
-                    results['files'].append({
-                        'path': local_file_path,
-                        'status': 'failed'
-                    })
+        # Upload the files concurrently, collecting results in order
+        executor = self._get_executor()
+        outcomes = list(executor.map(lambda upload: self.upload_file(*upload), uploads))
+        
+        for (local_file_path, _), success in zip(uploads, outcomes):
+            if success:
+                results['success'] += 1
+                results['files'].append({
+                    'path': local_file_path,
+                    'status': 'success'
+                })
+            else:
+                results['failed'] += 1
+                results['files'].append({
+                    'path': local_file_path,
+                    'status': 'failed'
+                })
         
-        logger.info(f"Uploaded {results['success']} files to {sharepoint_folder_path}, {results['failed']} failed")
         return results
 
 # Example usage
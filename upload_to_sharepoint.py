@@ -3,9 +3,14 @@
 Script to upload Freshdesk tickets and attachments to SharePoint
 """
 import os
-import json
 import argparse
 import logging
+from collections import deque
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice, zip_longest
+from pathlib import Path
+import json_utils
 from sharepoint_client import SharePointClient
 
 # Set up logging
@@ -15,6 +20,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Tickets per $batch request; each ticket is two operations (folder and metadata file)
+METADATA_BATCH_SIZE = 50
+
 def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description='Upload Freshdesk tickets and attachments to SharePoint')
@@ -24,23 +32,22 @@ def parse_arguments():
     parser.add_argument('--tickets-dir', required=True, help='Directory containing ticket data')
     parser.add_argument('--attachments-dir', required=True, help='Directory containing ticket attachments')
     parser.add_argument('--sharepoint-folder', default='FreshdeskTickets', help='Base folder in SharePoint')
+    parser.add_argument('--concurrency', type=int, default=10, help='Number of tickets to upload concurrently')
+    parser.add_argument('--processes', type=int, default=1, help='Number of worker processes to shard tickets across')
     return parser.parse_args()
 
-def load_tickets_from_file(file_path):
+def iter_tickets_from_file(file_path):
     """
-    Load tickets from a JSON file
+    Iterate over the tickets in a JSON file without loading them all at once
     
     Args:
         file_path (str): Path to the JSON file
         
-    Returns:
-        list: List of ticket objects
+    Yields:
+        dict: Ticket object
     """
-    with open(file_path, 'r') as f:
-        tickets = json.load(f)
-    
-    logger.info(f"Loaded {len(tickets)} tickets from {file_path}")
-    return tickets
+    logger.info(f"Reading tickets from {file_path}")
+    yield from json_utils.iter_array_file(file_path)
 
 def find_latest_tickets_file(tickets_dir):
     """
@@ -52,16 +59,44 @@ def find_latest_tickets_file(tickets_dir):
     Returns:
         str: Path to the latest tickets file
     """
-    json_files = [f for f in os.listdir(tickets_dir) if f.startswith('tickets_') and f.endswith('.json')]
+    # Pick the greatest filename (which includes timestamp) in a single pass
+    with os.scandir(tickets_dir) as entries:
+        latest_file = max(
+            (
+                entry for entry in entries
+                if entry.name.startswith('tickets_') and entry.name.endswith('.json') and entry.is_file()
+            ),
+            key=lambda entry: entry.name,
+            default=None
+        )
     
-    if not json_files:
+    if latest_file is None:
         raise FileNotFoundError(f"No ticket files found in {tickets_dir}")
     
-    # Sort by filename (which includes timestamp)
-    latest_file = sorted(json_files)[-1]
-    return os.path.join(tickets_dir, latest_file)
+    return latest_file.path
 
-def upload_ticket_to_sharepoint(client, ticket, attachments_dir, sharepoint_base_folder):
+def scan_attachment_dirs(attachments_dir):
+    """
+    List the per-ticket attachment directories with a single directory read
+    
+    Args:
+        attachments_dir (str): Directory containing ticket attachments
+        
+    Returns:
+        dict: Paths of the ticket_<id> directories, keyed by directory name
+    """
+    try:
+        with os.scandir(attachments_dir) as entries:
+            return {
+                entry.name: entry.path
+                for entry in entries
+                if entry.name.startswith('ticket_') and entry.is_dir()
+            }
+    except FileNotFoundError:
+        return {}
+
+def upload_ticket_to_sharepoint(client, ticket, attachments_dir, sharepoint_base_folder, attachment_paths=None,
+                                metadata_uploaded=False, attachment_dirs=None):
     """
     Upload a ticket and its attachments to SharePoint
     
@@ -70,6 +105,11 @@ def upload_ticket_to_sharepoint(client, ticket, attachments_dir, sharepoint_base
         ticket (dict): Ticket object
         attachments_dir (str): Directory containing ticket attachments
         sharepoint_base_folder (str): Base folder in SharePoint
+        attachment_paths (list): Downloaded attachment paths (if not provided, the ticket's
+            attachments directory is walked)
+        metadata_uploaded (bool): The ticket folder and metadata were already created in a batch
+        attachment_dirs (dict): Ticket attachment directories from scan_attachment_dirs (if not
+            provided, the ticket's directory is checked on disk)
         
     Returns:
         dict: Upload results
@@ -77,86 +117,269 @@ def upload_ticket_to_sharepoint(client, ticket, attachments_dir, sharepoint_base
     ticket_id = ticket['id']
     ticket_subject = ticket.get('subject', 'No subject')
     
-    # Create a folder for the ticket
     ticket_folder = f"{sharepoint_base_folder}/Ticket_{ticket_id}"
-    client.create_folder(ticket_folder)
-    
-    # Save ticket metadata to a temporary file and upload it
-    temp_metadata_file = f"/tmp/ticket_{ticket_id}_metadata.json"
-    with open(temp_metadata_file, 'w') as f:
-        json.dump(ticket, f, indent=2)
-    
-    # Upload the metadata file
-    client.upload_file(temp_metadata_file, ticket_folder)
-    
-    # Clean up the temporary file
-    os.remove(temp_metadata_file)
+    if not metadata_uploaded:
+        # Create a folder for the ticket
+        client.create_folder(ticket_folder)
+        
+        # Upload the ticket metadata straight from memory
+        client.upload_bytes(
+            json_utils.dumps(ticket, indent=True),
+            ticket_folder,
+            f"ticket_{ticket_id}_metadata.json"
+        )
     
     # Check if there are attachments for this ticket
-    ticket_attachments_dir = os.path.join(attachments_dir, f"ticket_{ticket_id}")
-    if os.path.exists(ticket_attachments_dir):
+    if attachment_dirs is not None:
+        ticket_attachments_dir = attachment_dirs.get(f"ticket_{ticket_id}")
+    else:
+        ticket_attachments_dir = os.path.join(attachments_dir, f"ticket_{ticket_id}")
+        if not os.path.isdir(ticket_attachments_dir):
+            ticket_attachments_dir = None
+    
+    if attachment_paths is not None:
+        # The download step already knows the files, so skip walking the directory
+        uploads = [(path, ticket_folder) for path in attachment_paths]
+        if ticket_attachments_dir is not None:
+            metadata_path = os.path.join(ticket_attachments_dir, "ticket_metadata.json")
+            if os.path.exists(metadata_path):
+                uploads.append((metadata_path, ticket_folder))
+        upload_results = client.upload_files(uploads) if uploads else None
+    elif ticket_attachments_dir is not None:
         # Upload all attachments
         upload_results = client.upload_folder_contents(ticket_attachments_dir, ticket_folder)
-        logger.info(f"Uploaded {upload_results['success']} attachments for ticket {ticket_id}")
-        return {
-            'ticket_id': ticket_id,
-            'subject': ticket_subject,
-            'metadata_uploaded': True,
-            'attachments': upload_results
-        }
     else:
+        upload_results = None
+    
+    if upload_results is None:
         logger.info(f"No attachments found for ticket {ticket_id}")
-        return {
-            'ticket_id': ticket_id,
-            'subject': ticket_subject,
-            'metadata_uploaded': True,
-            'attachments': {'success': 0, 'failed': 0, 'files': []}
-        }
+        upload_results = {'success': 0, 'failed': 0, 'files': []}
+    else:
+        logger.info(f"Uploaded {upload_results['success']} attachments for ticket {ticket_id}")
+    
+    return {
+        'ticket_id': ticket_id,
+        'subject': ticket_subject,
+        'metadata_uploaded': True,
+        'attachments': upload_results
+    }
 
-def main():
-    """Main function"""
-    args = parse_arguments()
+def summarize_results(results):
+    """
+    Count the uploaded tickets and attachments in a single pass over the results
     
-    # Create SharePoint client
-    client = SharePointClient(args.site_url, args.username, args.password)
+    Args:
+        results (list): Upload results returned by upload_ticket_to_sharepoint
+        
+    Returns:
+        tuple: (total tickets, attachments uploaded, attachments failed)
+    """
+    success = failed = 0
+    for result in results:
+        attachments = result['attachments']
+        success += attachments['success']
+        failed += attachments['failed']
+    return len(results), success, failed
+
+def upload_tickets(client, tickets, attachments_dir, sharepoint_folder, downloaded=None, concurrency=10,
+                   attachment_dirs=None):
+    """
+    Upload tickets and their attachments to SharePoint, a batch at a time
     
-    # Find the latest tickets file
-    try:
-        tickets_file = find_latest_tickets_file(args.tickets_dir)
-    except FileNotFoundError as e:
-        logger.error(str(e))
-        return
+    Args:
+        client (SharePointClient): SharePoint client
+        tickets (iterable): Ticket objects, read lazily a batch at a time
+        attachments_dir (str): Directory containing ticket attachments
+        sharepoint_folder (str): Base folder in SharePoint, which must already exist
+        downloaded (dict): Mapping of ticket ID to downloaded attachment paths
+        concurrency (int): Number of tickets to upload concurrently
+        attachment_dirs (dict): Ticket attachment directories from scan_attachment_dirs
+        
+    Returns:
+        list: Upload results for each ticket, in ticket order
+    """
+    tickets = iter(tickets)
     
-    # Load tickets
-    tickets = load_tickets_from_file(tickets_file)
+    # Upload each ticket and its attachments; the per-run constants and bound
+    # methods are captured as default arguments so each call only reads locals
+    def upload_one(ticket, metadata_uploaded, _upload=upload_ticket_to_sharepoint, _client=client,
+                   _attachments_dir=attachments_dir, _base_folder=sharepoint_folder,
+                   _downloaded=downloaded, _attachment_dirs=attachment_dirs, _log=logger.info):
+        ticket_id = ticket['id']
+        _log(f"Uploading ticket {ticket_id}: {ticket.get('subject', 'No subject')}")
+        return _upload(
+            _client, 
+            ticket, 
+            _attachments_dir, 
+            _base_folder,
+            attachment_paths=_downloaded.get(ticket_id, []) if _downloaded is not None else None,
+            metadata_uploaded=metadata_uploaded,
+            attachment_dirs=_attachment_dirs
+        )
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        while True:
+            group = list(islice(tickets, METADATA_BATCH_SIZE))
+            if not group:
+                break
+            
+            # Create the ticket folders and upload their metadata in one batch request
+            items = [
+                (
+                    f"{sharepoint_folder}/Ticket_{ticket['id']}",
+                    f"ticket_{ticket['id']}_metadata.json",
+                    json_utils.dumps(ticket, indent=True)
+                )
+                for ticket in group
+            ]
+            batched = client.add_folders_with_files(items, batch_size=2 * METADATA_BATCH_SIZE)
+            
+            # Tickets are uploaded concurrently; results are collected in ticket order
+            for ticket in group:
+                pending.append(executor.submit(upload_one, ticket, batched))
+            
+            # Bound the number of tickets waiting in memory
+            while len(pending) > concurrency * 4:
+                results.append(pending.popleft().result())
+            logger.info(f"Queued {len(results) + len(pending)} tickets for upload")
+        
+        results.extend(future.result() for future in pending)
+    return results
+
+def upload_shard(client_settings, tickets_file, shard, shards, attachments_dir, sharepoint_folder,
+                 downloaded=None, concurrency=10, attachment_dirs=None):
+    """
+    Upload every shards-th ticket of a tickets file from a worker process
+    
+    The worker reads the tickets file itself and builds its own SharePoint client,
+    so neither the tickets nor the client have to be sent between processes.
+    
+    Args:
+        client_settings (dict): Keyword arguments for SharePointClient
+        tickets_file (str): Tickets JSON file
+        shard (int): Index of this worker's shard
+        shards (int): Total number of shards
+        attachments_dir (str): Directory containing ticket attachments
+        sharepoint_folder (str): Base folder in SharePoint, which must already exist
+        downloaded (dict): Mapping of ticket ID to downloaded attachment paths
+        concurrency (int): Number of tickets to upload concurrently
+        attachment_dirs (dict): Ticket attachment directories from scan_attachment_dirs
+        
+    Returns:
+        list: Upload results for the shard's tickets, in ticket order
+    """
+    tickets = islice(iter_tickets_from_file(tickets_file), shard, None, shards)
+    with SharePointClient(**client_settings) as client:
+        return upload_tickets(
+            client,
+            tickets,
+            attachments_dir,
+            sharepoint_folder,
+            downloaded=downloaded,
+            concurrency=concurrency,
+            attachment_dirs=attachment_dirs
+        )
+
+def run(client, tickets_dir, attachments_dir, sharepoint_folder, tickets_file=None, downloaded=None, concurrency=10,
+        processes=1):
+    """
+    Upload all tickets and their attachments to SharePoint
+    
+    Args:
+        client (SharePointClient): SharePoint client
+        tickets_dir (str): Directory containing ticket data
+        attachments_dir (str): Directory containing ticket attachments
+        sharepoint_folder (str): Base folder in SharePoint
+        tickets_file (str): Tickets JSON file (defaults to the latest one in tickets_dir)
+        downloaded (dict): Mapping of ticket ID to downloaded attachment paths, as returned
+            by the download step (if not provided, attachment directories are walked)
+        concurrency (int): Number of tickets to upload concurrently (per process)
+        processes (int): Number of worker processes to shard the tickets across
+        
+    Returns:
+        list: Upload results for each ticket
+    """
+    # Find the latest tickets file
+    if tickets_file is None:
+        tickets_file = find_latest_tickets_file(tickets_dir)
     
     # Create the base folder in SharePoint
-    client.create_folder(args.sharepoint_folder)
+    client.create_folder(sharepoint_folder)
     
-    # Upload each ticket and its attachments
-    results = []
-    for ticket in tickets:
-        logger.info(f"Uploading ticket {ticket['id']}: {ticket.get('subject', 'No subject')}")
-        result = upload_ticket_to_sharepoint(
-            client, 
-            ticket, 
-            args.attachments_dir, 
-            args.sharepoint_folder
+    # Find the ticket attachment directories once rather than checking each ticket's
+    attachment_dirs = scan_attachment_dirs(attachments_dir)
+    
+    if processes > 1:
+        # Tickets are dealt round-robin to worker processes, each with its own client
+        client_settings = {
+            'site_url': client.site_url,
+            'username': client.username,
+            'password': client.password,
+            'max_workers': client.max_workers,
+            'chunk_size': client.chunk_size
+        }
+        # spawn avoids forking a process that already has running threads
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [
+                pool.submit(
+                    upload_shard,
+                    client_settings,
+                    tickets_file,
+                    shard,
+                    processes,
+                    attachments_dir,
+                    sharepoint_folder,
+                    downloaded,
+                    concurrency,
+                    attachment_dirs
+                )
+                for shard in range(processes)
+            ]
+            shard_results = [future.result() for future in futures]
+        
+        # Interleave the shards back into ticket order
+        results = [result for group in zip_longest(*shard_results) for result in group if result is not None]
+    else:
+        results = upload_tickets(
+            client,
+            iter_tickets_from_file(tickets_file),
+            attachments_dir,
+            sharepoint_folder,
+            downloaded=downloaded,
+            concurrency=concurrency,
+            attachment_dirs=attachment_dirs
         )
-        results.append(result)
     
     # Save upload results
-    results_file = os.path.join(args.tickets_dir, "upload_results.json")
-    with open(results_file, 'w') as f:
-        json.dump(results, f, indent=2)
+    results_file = os.path.join(tickets_dir, "upload_results.json")
+    Path(results_file).write_bytes(json_utils.dumps(results, indent=True))
     
     # Calculate summary statistics
-    total_tickets = len(results)
-    total_attachments_success = sum(r['attachments']['success'] for r in results)
-    total_attachments_failed = sum(r['attachments']['failed'] for r in results)
+    total_tickets, total_attachments_success, total_attachments_failed = summarize_results(results)
     
     logger.info(f"Upload completed: {total_tickets} tickets, {total_attachments_success} attachments uploaded, {total_attachments_failed} attachments failed")
     logger.info(f"Results saved to {results_file}")
+    return results
+
+def main():
+    """Main function"""
+    args = parse_arguments()
+    
+    # Create SharePoint client
+    with SharePointClient(args.site_url, args.username, args.password) as client:
+        try:
+            run(
+                client,
+                args.tickets_dir,
+                args.attachments_dir,
+                args.sharepoint_folder,
+                concurrency=args.concurrency,
+                processes=args.processes
+            )
+        except FileNotFoundError as e:
+            logger.error(str(e))
 
 if __name__ == "__main__":
     main()